@@ -4,13 +4,16 @@
 import sys
 import re
 import os.path
-import json
-import cjson
-from random import sample, random
-from hashlib import sha1
+import mmap
+import ujson
+import base64
 from collections import namedtuple, Counter
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
 
+import xxhash
 import requests
+from requests.adapters import HTTPAdapter
 requests.packages.urllib3.disable_warnings()
 
 import seaborn as sns
@@ -21,8 +24,10 @@ import matplotlib.ticker as mtick
 # For cyrillic labels
 rc('font', family='Verdana', weight='normal')
 
+import numpy as np
 import pandas as pd
-from bs4 import BeautifulSoup
+import lxml.html
+from lxml import etree
 
 
 DATA_DIR = 'data'
@@ -30,10 +35,26 @@ HTML_DIR = os.path.join(DATA_DIR, 'html')
 HTML_LIST = os.path.join(HTML_DIR, 'list.txt')
 ROOT_URL = 'https://www.reformagkh.ru/myhouse?geo=reset'
 REGIONS = os.path.join(DATA_DIR, 'regions.json')
-REGION_LISTS = os.path.join(DATA_DIR, 'region_lists.json')
-PROFILES_DIR = os.path.join(DATA_DIR, 'profiles')
+REGION_LISTS = os.path.join(DATA_DIR, 'region_lists.parquet')
+REGION_COMPANIES = os.path.join(DATA_DIR, 'region_companies.json')
+PROFILES = os.path.join(DATA_DIR, 'profiles.jsonl')
+PROFILES_INDEX = os.path.join(DATA_DIR, 'profiles_index.txt')
 BLUE = '#4a71b2'
 DATA = 'data.csv'
+DATA_COLUMNS = ['latitude', 'longitude', 'year', 'floors',
+                'appartments', 'parking', 'repair', 'energy']
+LEFT_ROWS_XPATH = etree.XPath('//tr[@class="left"]')
+GRID_XPATH = etree.XPath('//div[@class="grid"]')
+# Skip header
+GRID_ROWS_XPATH = etree.XPath('((.//table)[1]//tr)[position() > 1]')
+CELLS_XPATH = etree.XPath('./td')
+LINK_XPATH = etree.XPath('.//a')
+SPAN_XPATH = etree.XPath('.//span')
+TID_RE = re.compile(r'tid=(\d+)')
+PROFILE_ID_RE = re.compile(r'^/myhouse/profile/view/(\d+)/')
+COORDINATES_RE = re.compile(
+    r'var myPlacemark = new ymaps\.Placemark\(\s+\[([\d\.]+),([\d\.]+)\]'
+)
 
 
 RegionRecord = namedtuple(
@@ -149,14 +170,17 @@ def kill_thread(thread):
 
 
 def get_chunks(sequence, count):
+    # Contiguous slices, neighbour urls end up in one chunk
     count = min(count, len(sequence))
-    chunks = [[] for _ in range(count)]
-    for index, item in enumerate(sequence):
-        chunks[index % count].append(item) 
-    return chunks
+    bounds = np.linspace(0, len(sequence), count + 1).astype(int)
+    return [
+        sequence[start:stop]
+        for start, stop in zip(bounds[:-1], bounds[1:])
+    ]
 
 def hash_url(url):
-    return sha1(url.encode('utf8')).hexdigest()
+    digest = xxhash.xxh64(url.encode('utf8')).digest()
+    return base64.b32encode(digest).rstrip('=')
 
 
 def get_html_filename(url):
@@ -166,18 +190,29 @@ def get_html_filename(url):
 
 
 def get_html_path(url):
+    # Shard by hash prefix to keep directories small
+    filename = get_html_filename(url)
     return os.path.join(
         HTML_DIR,
-        get_html_filename(url)
+        filename[:2],
+        filename
     )
 
 
+def ensure_parent_dir(path):
+    dir = os.path.dirname(path)
+    if not os.path.exists(dir):
+        os.makedirs(dir)
+
+
 def list_urls_cache(path):
-    with open(path) as file:
-        for line in file:
-            line = line.decode('utf8').strip()
-            hash, url = line.split('\t', 1)
-            yield url
+    # One read and split, only url part is decoded
+    with open(path, 'rb') as file:
+        lines = file.read().split('\n')
+    for line in lines:
+        if line:
+            _, url = line.split('\t', 1)
+            yield url.decode('utf8')
 
 
 def list_html_cache():
@@ -210,11 +245,38 @@ def dump_html(url, html):
     path = get_html_path(url)
     if html is None:
         html = ''
+    ensure_parent_dir(path)
     with open(path, 'w') as file:
         file.write(html.encode('utf8'))
     update_html_cache(url)
 
 
+def migrate_html_cache():
+    # Move pages cached under flat sha1 names to sharded names. Backup of
+    # the old list is the only url to sha1 mapping, it is never
+    # overwritten, so interrupted migration resumes from it
+    backup = HTML_LIST + '.sha1'
+    if os.path.exists(backup):
+        if os.path.exists(HTML_LIST):
+            raise ValueError('html cache is already migrated: ' + backup)
+    else:
+        os.rename(HTML_LIST, backup)
+    temp = HTML_LIST + '.tmp'
+    if os.path.exists(temp):
+        os.remove(temp)
+    with open(backup) as file:
+        for line in file:
+            line = line.decode('utf8').strip()
+            hash, url = line.split('\t', 1)
+            source = os.path.join(HTML_DIR, hash + '.html')
+            if os.path.exists(source):  # url may be listed twice
+                path = get_html_path(url)
+                ensure_parent_dir(path)
+                os.rename(source, path)
+            update_urls_cache(url, temp)
+    os.rename(temp, HTML_LIST)
+
+
 def load_text(path):
     with open(path) as file:
         return file.read().decode('utf8')
@@ -225,17 +287,30 @@ def load_html(url):
     return load_text(path)
 
 
+def get_session(size=32):
+    # Keep connections alive, no TLS handshake per url
+    session = requests.Session()
+    session.headers.update({
+        'User-Agent': ('Mozilla/5.0 (Windows NT 6.3; Win64; x64) '
+                       'AppleWebKit/537.36 (KHTML, like Gecko) '
+                       'Chrome/37.0.2049.0 Safari/537.36')
+    })
+    adapter = HTTPAdapter(
+        pool_connections=size,
+        pool_maxsize=size,
+        max_retries=3
+    )
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+SESSION = get_session()
+
+
 def curl_url(url):
     try:
-        response = requests.get(
-            url,
-            headers={
-                'User-Agent': ('Mozilla/5.0 (Windows NT 6.3; Win64; x64) '
-                               'AppleWebKit/537.36 (KHTML, like Gecko) '
-                               'Chrome/37.0.2049.0 Safari/537.36')
-            },
-            timeout=100
-        )
+        response = SESSION.get(url, timeout=100)
         return response.text
     except requests.RequestException:
         return None
@@ -246,13 +321,26 @@ def fetch_url(url):
     dump_html(url, html)
 
 
-def fetch_urls(urls):
-    for url in urls:
-        fetch_url(url)
+def fetch_urls(urls, workers=32):
+    # Fetching is network bound, threads overlap waiting. Pages are
+    # dumped from this thread so list.txt appends do not race
+    pool = ThreadPool(workers)
+    try:
+        results = pool.imap_unordered(
+            lambda url: (url, curl_url(url)),
+            urls
+        )
+        for url, html in results:
+            dump_html(url, html)
+    finally:
+        pool.terminate()
 
 
-def get_soup(html):
-    return BeautifulSoup(html, 'lxml')
+def get_tree(html):
+    if not html:
+        # Failed fetches are cached as empty pages, lxml rejects those
+        html = u'<html></html>'
+    return lxml.html.fromstring(html)
 
 
 def parse_reforma_int(string):
@@ -260,17 +348,19 @@ def parse_reforma_int(string):
 
 
 def parse_regions_list(html, parent=None):
-    soup = get_soup(html)
-    for item in soup.find_all('tr', class_='left'):
-        link = item.find('a')
-        if link:
+    tree = get_tree(html)
+    for item in LEFT_ROWS_XPATH(tree):
+        links = LINK_XPATH(item)
+        if links:
+            link = links[0]
             tid = None
-            if link.has_attr('href'):  # if item is disampled tag is a
-                                       # but has no href
-                tid = int(re.search('tid=(\d+)', link['href']).group(1))
-            name = link.text
-            next = item.find_next_sibling()
-            buildings = parse_reforma_int(next.find('span').text)
+            href = link.get('href')
+            if href is not None:  # if item is disampled tag is a
+                                  # but has no href
+                tid = int(TID_RE.search(href).group(1))
+            name = link.text_content()
+            next = item.getnext()
+            buildings = parse_reforma_int(SPAN_XPATH(next)[0].text_content())
             yield RegionRecord(parent, name, tid, buildings)
 
 
@@ -305,13 +395,15 @@ def load_raw_subregions(regions):
 
 
 def load_json_data(path):
-    with open(path) as file:
-        return cjson.decode(file.read())
+    with open(path, 'rb') as file:
+        return ujson.loads(file.read())
     
 
 def dump_json_data(data, path):
-    with open(path, 'w') as file:
-        return json.dump(data, file)
+    # Serialize first so failed dump does not truncate existing file
+    data = ujson.dumps(data)
+    with open(path, 'wb') as file:
+        file.write(data)
 
 
 def dump_regions(regions):
@@ -330,22 +422,29 @@ def dump_regions(regions):
     dump_json_data((parents, leafs), REGIONS)
 
 
-def load_parent_region(id, parents):
-    parent_id, name, buildings = parents[id]
-    if parent_id is None:
-        parent = None
-    else:
-        parent = load_parent_region(parent_id, parents)
-    # NOTE New memory for every parent
-    return RegionRecord(parent, name, id, buildings)
+def load_parent_regions(parents):
+    # Every parent is built once and shared by its children
+    regions = {}
+    for id in parents:
+        chain = []
+        while id is not None and id not in regions:
+            chain.append(id)
+            id = parents[id][0]
+        parent = regions.get(id)
+        for id in reversed(chain):
+            _, name, buildings = parents[id]
+            parent = RegionRecord(parent, name, id, buildings)
+            regions[id] = parent
+    return regions
 
 
 def load_regions():
     parents, leafs = load_json_data(REGIONS)
     parents = {int(key): value for key, value in parents.iteritems()}
+    parents = load_parent_regions(parents)
     for parent_id, name, id, buildings in leafs:
         yield RegionRecord(
-            load_parent_region(parent_id, parents),
+            parents[parent_id],
             name, id, buildings
         )
 
@@ -363,28 +462,27 @@ def parse_reforma_float(string):
 
 
 def parse_region_list(html, region=None):
-    soup = get_soup(html)
-    table = soup.find('div', class_='grid')
-    if table is None:
+    tree = get_tree(html)
+    grids = GRID_XPATH(tree)
+    if not grids:
         print >>sys.stderr, 'Unable to parse region:', region.id
         return
-    table = table.find('table')
-    for row in table.find_all('tr')[1:]:  # skip header
-        address, year, area, company = row.find_all('td')
-        link = address.find('a')
-        id = int(re.search('^/myhouse/profile/view/(\d+)/', link['href']).group(1))
-        address = link.text
-        year = year.text
+    for row in GRID_ROWS_XPATH(grids[0]):
+        address, year, area, company = CELLS_XPATH(row)
+        link = LINK_XPATH(address)[0]
+        id = int(PROFILE_ID_RE.search(link.get('href')).group(1))
+        address = link.text_content()
+        year = year.text_content()
         if year == u'н.д.':
             year = None
         else:
             year = int(year)
-        area = area.text
+        area = area.text_content()
         if area == u'н.д.':
             area = None
         else:
             area = parse_reforma_float(area)
-        company = company.text
+        company = company.text_content()
         if company == u'Не заполнено':
             company = None
         yield RegionListRecord(region, id, address, year, area, company)
@@ -403,38 +501,48 @@ def load_raw_region_lists(regions):
 def dump_region_lists(results):
     data = []
     companies = {}
-    for company_id, (region, id, address, year, area, company) in enumerate(results):
-        if company is None:
-            company_id = None
-        else:
-            if company in companies:
-                company_id = companies[company]
-            else:
-                companies[company] = company_id
+    for region, id, address, year, area, company in results:
+        company_id = None
+        if company is not None:
+            # Dense ids in order of first appearance
+            company_id = companies.setdefault(company, len(companies))
         data.append((
             region.id,
             id,
-            address,
+            # lxml gives str for ascii text, one str makes pyarrow store
+            # whole column as binary
+            unicode(address),
             year,
             area,
             company_id
         ))
-    dump_json_data((companies, data), REGION_LISTS)
+    table = pd.DataFrame(
+        data,
+        columns=['region', 'id', 'address', 'year', 'area', 'company']
+    )
+    table.to_parquet(REGION_LISTS, compression='zstd')
+    # Dicts keep insertion order only in Python 3.7+, sort by id
+    companies = sorted(companies, key=companies.get)
+    dump_json_data(companies, REGION_COMPANIES)
 
 
 def load_region_lists(regions):
     regions = {_.id: _ for _ in regions}
-    companies, results = load_json_data(REGION_LISTS)
-    companies = {id: name for name, id in companies.iteritems()}
-    companies[None] = None
-    for region_id, id, address, year, area, company_id in results:
+    companies = load_json_data(REGION_COMPANIES)
+    table = pd.read_parquet(REGION_LISTS)
+    # Nullable ints come back as floats with NaN
+    table = table.astype(object).where(table.notnull(), None)
+    for region_id, id, address, year, area, company_id in table.itertuples(index=False):
+        company = None
+        if company_id is not None:
+            company = companies[int(company_id)]
         yield RegionListRecord(
             regions[region_id],
             id,
             address,
-            year,
+            int_or_none(year),
             area,
-            companies[company_id]
+            company
         )
 
 
@@ -453,8 +561,7 @@ def building_profile_url(id):
 
 
 def parse_building_profile_coordinates(html):
-    match = re.search('var myPlacemark = new ymaps\.Placemark'
-                      '\(\s+\[([\d\.]+),([\d\.]+)\]', html)
+    match = COORDINATES_RE.search(html)
     if match:
         longitude, latitude = match.groups()
         longitude = float(longitude)
@@ -529,14 +636,11 @@ def parse_building_profile_types(data):
 
 def parse_building_profile_data(html):
     data = {}
-    for match in re.finditer(
-        r'<tr class="left".*?>(.+?)</tr>\s+<tr.*?>(.+?)</tr>', html, re.S
-    ):
-        key, value = match.groups()
-        match = re.search(r'<span.*?>(.+?)</span>', key)
-        key = match.group(1)
-        match = re.search(r'<span.*?>(.+?)</span>', value, re.S)
-        value = match.group(1).strip()
+    tree = get_tree(html)
+    for row in LEFT_ROWS_XPATH(tree):
+        # Pair per row, extra spans in a value row must not shift keys
+        key = SPAN_XPATH(row)[0].text_content()
+        value = SPAN_XPATH(row.getnext())[0].text_content().strip()
         if value == u'Не заполнено':
             value = None
         data[key] = value
@@ -555,28 +659,29 @@ def parse_building_profile(html, region=None, id=None):
     )
 
 
-def get_profile_filename(id):
-    return '{id}.json'.format(id=id)
-
+def load_profiles_index():
+    # Profile may be dumped several times, last offset wins
+    index = {}
+    with open(PROFILES_INDEX) as file:
+        for line in file:
+            id, offset = line.split('\t', 1)
+            index[int(id)] = int(offset)
+    return index
 
-def get_profile_path(id):
-    return os.path.join(
-        PROFILES_DIR,
-        get_profile_filename(id)
-    )
 
+def list_profiles_cache():
+    for id in load_profiles_index():
+        yield id
 
-def parse_profile_filename(filename):
-    id, _ = filename.split('.', 1)
-    return int(id)
 
+def update_profiles_index(id, offset, file):
+    file.write('{id}\t{offset}\n'.format(
+        id=id,
+        offset=offset
+    ))
 
-def list_profiles_cache():
-    for filename in os.listdir(PROFILES_DIR):
-        yield parse_profile_filename(filename)
 
-
-def dump_profile(profile):
+def dump_profile(profile, file, index):
     region, id, coordinates, when_was, number_of, type_of = profile
     data = [
         region.id,
@@ -586,71 +691,135 @@ def dump_profile(profile):
         number_of,
         type_of
     ]
-    path = get_profile_path(id)
-    dump_json_data(data, path)
+    # Position is undefined in append mode until first write
+    file.seek(0, os.SEEK_END)
+    offset = file.tell()
+    file.write(ujson.dumps(data) + '\n')
+    # Index must never point past data on disk
+    file.flush()
+    update_profiles_index(id, offset, index)
     
 
-def preparse_profile(result):
+def preparse_profile(result, file, index):
     id = result.id
     url = building_profile_url(id)
     html = load_html(url)
     profile = parse_building_profile(html, result.region, id)
-    dump_profile(profile)
+    dump_profile(profile, file, index)
 
 
 def preparse_profiles(results):
-    for result in results:
-        preparse_profile(result)
+    with open(PROFILES, 'ab') as file, open(PROFILES_INDEX, 'a') as index:
+        for result in results:
+            preparse_profile(result, file, index)
+
+
+@contextmanager
+def map_profiles():
+    # Random access by offset without seek and buffer refill per profile
+    with open(PROFILES, 'rb') as file:
+        if not os.fstat(file.fileno()).st_size:
+            # mmap refuses empty files, nothing to map anyway
+            yield ''
+            return
+        profiles = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            yield profiles
+        finally:
+            profiles.close()
 
 
-def load_profile(id, regions_mapping):
-    path = get_profile_path(id)
-    data = load_json_data(path)
+def load_profile_data(profiles, offset):
+    end = profiles.find('\n', offset)
+    if end == -1:
+        raise ValueError(
+            'Profile at offset {offset} is truncated, '
+            'rerun preparse_profiles'.format(offset=offset)
+        )
+    return ujson.loads(profiles[offset:end])
+
+
+def load_profile(profiles, offset, regions_mapping):
+    data = load_profile_data(profiles, offset)
     region_id, id, coordinates, when_was, number_of, type_of = data
+    # _make skips packing and unpacking of *args in generated __new__
     if coordinates is not None:
-        coordinates = Coordinates(*coordinates)
+        coordinates = Coordinates._make(coordinates)
     floors, appartments, entrances, elevators, area, parking = number_of
-    floors = BuildingFloors(*floors)
+    floors = BuildingFloors._make(floors)
     return BuildingProfile(
         regions_mapping[region_id],
         id,
         coordinates,
-        WhenBuildingWas(*when_was),
+        WhenBuildingWas._make(when_was),
         BuildingMeasures(floors, appartments, entrances, elevators, area, parking),
-        BuildingType(*type_of)
+        BuildingType._make(type_of)
     )
 
 
 def load_profiles(results, regions):
     mapping = {_.id: _ for _ in regions}
-    for result in results:
-        yield load_profile(result.id, mapping)
+    index = load_profiles_index()
+    with map_profiles() as profiles:
+        for result in results:
+            yield load_profile(profiles, index[result.id], mapping)
+
+
+def stream_profile_fields(results):
+    # Only the fields data.csv and plots need, no records are built
+    index = load_profiles_index()
+    with map_profiles() as profiles:
+        for result in results:
+            data = load_profile_data(profiles, index[result.id])
+            _, _, coordinates, when_was, number_of, type_of = data
+            latitude, longitude = None, None
+            if coordinates:
+                # Placemark takes [latitude, longitude], so Coordinates
+                # fields are swapped
+                latitude, longitude = coordinates
+            _, opened = when_was
+            floors, appartments, _, _, _, parking = number_of
+            _, _, _, repair, energy = type_of
+            yield (
+                latitude,
+                longitude,
+                opened,
+                floors[1],
+                appartments,
+                parking,
+                repair,
+                energy
+            )
 
 
-def show_buildings_count_by_year(profiles):
-    data = []
-    for profile in profiles:
-        year = profile.when_was.opened
-        if year is not None and 1900 <= year <= 2015:
-            data.append(year)
-    table = pd.Series(data)
+def load_profiles_table(results):
+    data = list(stream_profile_fields(results))
+    return pd.DataFrame(data, columns=DATA_COLUMNS)
+
+
+def filter_years(table):
+    return table[(table.year >= 1900) & (table.year <= 2015)]
+
+
+def format_ints(series):
+    # Keep 1960 from turning into 1960.0 in csv
+    return series.dropna().astype(int).astype(str).reindex(series.index)
+
+
+def show_buildings_count_by_year(table):
+    table = filter_years(table)
     fig, ax = plt.subplots()
-    table.value_counts().sort_index().plot(ax=ax)
+    table.year.value_counts().sort_index().plot(ax=ax)
     ax.set_ylabel(u'число новых домов')
     fig.savefig('fig.png', dpi=300, bbox_inches='tight')
 
 
-def show_floors_count_by_year(profiles):
-    data = []
-    xs = []
-    ys = []
-    for profile in sample(profiles, 100000):
-        year = profile.when_was.opened
-        if year is not None and 1900 <= year <= 2015:
-            floors = profile.number_of.floors.max
-            if floors is not None and floors <= 30:
-                xs.append(year + random())
-                ys.append(floors + (random() - 0.5) )
+def show_floors_count_by_year(table):
+    table = filter_years(table.sample(100000))
+    table = table[table.floors <= 30]
+    size = len(table)
+    xs = table.year + np.random.random(size)
+    ys = table.floors + (np.random.random(size) - 0.5)
     fig, ax = plt.subplots()
     ax.scatter(xs, ys, s=1, color=BLUE, alpha=0.1)
     ax.set_ylabel(u'число этажей')
@@ -659,17 +828,12 @@ def show_floors_count_by_year(profiles):
     fig.savefig('fig.png', dpi=300, bbox_inches='tight')
 
 
-def show_appartments_count_by_year(profiles):
-    data = []
-    xs = []
-    ys = []
-    for profile in sample(profiles, 100000):
-        year = profile.when_was.opened
-        if year is not None and 1900 <= year <= 2015:
-            appartments = profile.number_of.appartments
-            if appartments is not None and appartments <= 500:
-                xs.append(year + random())
-                ys.append(appartments + (random() - 0.5) )
+def show_appartments_count_by_year(table):
+    table = filter_years(table.sample(100000))
+    table = table[table.appartments <= 500]
+    size = len(table)
+    xs = table.year + np.random.random(size)
+    ys = table.appartments + (np.random.random(size) - 0.5)
     fig, ax = plt.subplots()
     ax.scatter(xs, ys, s=1, color=BLUE, alpha=0.1)
     ax.set_ylabel(u'число квартир')
@@ -678,51 +842,42 @@ def show_appartments_count_by_year(profiles):
     fig.savefig('fig.png', dpi=300, bbox_inches='tight')
 
 
-def dump_data(profiles):
-    data = []
-    cache = set()
-    for profile in profiles:
-        coordinates = profile.coordinates
-        if coordinates and coordinates not in cache:
-            cache.add(coordinates)
-            longitude, latitude = coordinates
-            year = profile.when_was.opened
-            if not 1900 <= year <= 2015:
-                year = None
-            else:
-                year = str(year)
-            number_of = profile.number_of
-            floors = number_of.floors.max
-            if floors is not None:
-                if floors < 5:
-                    floors = '1..4'
-                elif floors == 5:
-                    pass
-                elif floors < 9:
-                    floors = '6..8'
-                elif floors == 9:
-                    pass
-                else:
-                    floors = '>9'
-            appartments = number_of.appartments
-            if appartments is not None:
-                appartments = str(appartments)
-            parking = number_of.parking_meters
-            if parking is not None:
-                parking = parking > 0
-            type_of = profile.type_of
-            data.append((
-                longitude,
-                latitude,
-                year,
-                floors,
-                appartments,
-                parking,
-                type_of.repair,
-                type_of.energy
-            ))
-    table = pd.DataFrame(
-        sample(data, 500000),
-        columns=['latitude', 'longitude', 'year', 'floors',
-                 'appartments', 'parking', 'repair', 'energy'])
+def pack_coordinates(latitude, longitude):
+    # Site gives 6 decimals, so micro degrees keep distinct points
+    # distinct. Shift to non-negative to fit both into one int64
+    latitude = np.round((latitude.astype(float) + 90) * 1e6).astype(np.int64)
+    longitude = np.round((longitude.astype(float) + 180) * 1e6).astype(np.int64)
+    return (latitude << 32) | longitude
+
+
+def bucket_floors(floors):
+    # int8 codes, -1 for missing: 0 is 1..4, 1 is 5, 2 is 6..8, 3 is 9,
+    # 4 is >9
+    floors = floors.values.astype(float)
+    codes = np.searchsorted([4, 5, 8, 9], floors).astype(np.int8)
+    codes[np.isnan(floors)] = -1
+    return pd.Categorical.from_codes(codes, ['1..4', '5', '6..8', '9', '>9'])
+
+
+def dump_data(table):
+    table = table[table.latitude.notnull()]
+    keys = pack_coordinates(table.latitude.values, table.longitude.values)
+    _, index = np.unique(keys, return_index=True)
+    index.sort()  # first occurrences in original order
+    table = table.iloc[index]
+    year = table.year.where((table.year >= 1900) & (table.year <= 2015))
+    floors = pd.Series(bucket_floors(table.floors), index=table.index)
+    parking = table.parking
+    parking = (parking > 0).astype(object).where(parking.notnull())
+    table = pd.DataFrame({
+        'latitude': table.latitude,
+        'longitude': table.longitude,
+        'year': format_ints(year),
+        'floors': floors,
+        'appartments': format_ints(table.appartments),
+        'parking': parking,
+        'repair': table.repair,
+        'energy': table.energy
+    }, columns=DATA_COLUMNS)
+    table = table.sample(500000)
     table.to_csv(DATA, index=False)